@@ -84,7 +84,7 @@ class SnowflakeAzureRestClient(SnowflakeStorageClient):
         url: str,
         retry_id: Union[int, str],
         headers: Dict[str, Any] = None,
-        data: bytes = None,
+        data: Union[bytes, memoryview] = None,
     ) -> requests.Response:
         if not headers:
             headers = {}
@@ -179,7 +179,7 @@ class SnowflakeAzureRestClient(SnowflakeStorageClient):
             for _ in range(self.num_of_chunks)
         ]
 
-    def _upload_chunk(self, chunk_id: int, chunk: bytes) -> None:
+    def _upload_chunk(self, chunk_id: int, chunk: Union[bytes, memoryview]) -> None:
         container_name = quote(self.azure_location.container_name)
         path = quote(self.azure_location.path + self.meta.dst_file_name.lstrip("/"))
 
@@ -95,7 +95,7 @@ class SnowflakeGCSRestClient(SnowflakeStorageClient):
         self.last_err_is_presigned_url = presigned_url_expired
         return presigned_url_expired
 
-    def _upload_chunk(self, chunk_id: int, chunk: bytes) -> None:
+    def _upload_chunk(self, chunk_id: int, chunk: Union[bytes, memoryview]) -> None:
         meta = self.meta
 
         content_encoding = ""
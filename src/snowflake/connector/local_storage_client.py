@@ -9,9 +9,10 @@ from __future__ import division
 import os
 from logging import getLogger
 from math import ceil
-from typing import TYPE_CHECKING, Any, Dict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Union
 
 from .constants import ResultStatus
+from .local_util_sdk import copy_range
 from .storage_client import SnowflakeStorageClient
 from .vendored import requests
 
@@ -34,6 +35,11 @@ class SnowflakeLocalStorageClient(SnowflakeStorageClient):
         self.full_dst_file_name: str = os.path.join(
             stage_info["location"], os.path.basename(meta.dst_file_name)
         )
+        self.local_file_name: Optional[str] = (
+            os.path.join(meta.local_location, os.path.basename(meta.dst_file_name))
+            if meta.local_location
+            else None
+        )
 
     def get_file_header(self, filename: str) -> None:
         """
@@ -50,17 +56,32 @@ class SnowflakeLocalStorageClient(SnowflakeStorageClient):
         else:
             self.meta.result_status = ResultStatus.NOT_FOUND_FILE
 
+    def _copy_chunk(
+        self, src_file_name: str, dst_file_name: str, chunk_id: int
+    ) -> None:
+        """Copies a chunk of one file into the same place in another, existing one.
+
+        The target isn't truncated, so chunks don't overwrite each other.
+        """
+        with open(src_file_name, "rb") as sfd:
+            with open(dst_file_name, "r+b") as tfd:
+                offset = chunk_id * self.chunk_size
+                if self.num_of_chunks == 1:
+                    count = os.fstat(sfd.fileno()).st_size
+                else:
+                    count = self.chunk_size
+                tfd.seek(offset)
+                # Chunks already run on the transfer agent's thread pool
+                copy_range(sfd, tfd, offset, count, parallel=False)
+
+    def prepare_download(self) -> None:
+        super().prepare_download()
+        # Chunks are copied straight into place, not through the .part file
+        self.intermediate_dst_path.unlink()
+        open(self.local_file_name, "wb").close()
+
     def download_chunk(self, chunk_id: int) -> None:
-        with open(self.full_dst_file_name, "rb") as sfd:
-            with open(
-                os.path.join(
-                    self.meta.local_location, os.path.basename(self.meta.dst_file_name)
-                ),
-                "wb",
-            ) as tfd:
-                tfd.seek(chunk_id * self.chunk_size)
-                sfd.seek(chunk_id * self.chunk_size)
-                tfd.write(sfd.read(self.chunk_size))
+        self._copy_chunk(self.full_dst_file_name, self.local_file_name, chunk_id)
 
     def finish_download(self) -> None:
         self.meta.dst_file_size = os.stat(self.full_dst_file_name).st_size
@@ -78,9 +99,19 @@ class SnowflakeLocalStorageClient(SnowflakeStorageClient):
             self.num_of_chunks = 1
         else:
             self.num_of_chunks = ceil(self.meta.upload_size / self.chunk_size)
+        if self.meta.result_status != ResultStatus.SKIPPED:
+            # Truncated once here, chunks are then copied into place
+            open(self.full_dst_file_name, "wb").close()
+
+    def upload_chunk(self, chunk_id: int) -> None:
+        if self.meta.real_src_stream or self.meta.src_stream:
+            super().upload_chunk(chunk_id)
+        else:
+            # Files are copied straight to the stage instead of through a buffer
+            self._copy_chunk(self.data_file, self.full_dst_file_name, chunk_id)
 
-    def _upload_chunk(self, chunk_id: int, chunk: bytes) -> None:
-        with open(self.full_dst_file_name, "wb") as tfd:
+    def _upload_chunk(self, chunk_id: int, chunk: Union[bytes, memoryview]) -> None:
+        with open(self.full_dst_file_name, "r+b") as tfd:
             tfd.seek(chunk_id * self.chunk_size)
             tfd.write(chunk)
 
@@ -6,15 +6,160 @@
 
 from __future__ import division
 
+import errno
 import os
+import shutil
+from concurrent.futures.thread import ThreadPoolExecutor
 from logging import getLogger
-from typing import TYPE_CHECKING, Any, Dict
+from typing import IO, TYPE_CHECKING, Any, Dict
 
+from .compat import IS_LINUX
 from .constants import DEFAULT_S3_CONNECTION_POOL_SIZE, ResultStatus
 
 if TYPE_CHECKING:  # pragma: no cover
     from .file_transfer_agent_sdk import SnowflakeFileMeta
 
+# Buffer size used when a file can't be copied in-kernel
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# Files bigger than a chunk are copied with several copy_file_range calls in flight
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+COPY_MAX_CONCURRENCY = 8
+# copy_file_range errors that mean the kernel/filesystem can't do it, use sendfile
+COPY_FILE_RANGE_UNSUPPORTED = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+)
+# sendfile errors that mean the filesystem can't do it, use a buffered copy
+SENDFILE_UNSUPPORTED = (
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+)
+
+
+def _copy_file_range_chunk(in_fd: int, out_fd: int, offset: int, count: int) -> None:
+    """Copies count bytes at offset from in_fd to the same offset in out_fd."""
+    while count > 0:
+        copied = os.copy_file_range(in_fd, out_fd, count, offset, offset)
+        if copied == 0:
+            raise OSError(
+                errno.EIO,
+                f"copy_file_range copied nothing at offset {offset}, "
+                f"{count} bytes were left",
+            )
+        offset += copied
+        count -= copied
+
+
+def _copy_file_parallel(in_fd: int, out_fd: int, size: int) -> bool:
+    """Copies a file in COPY_CHUNK_SIZE pieces with concurrent copy_file_range.
+
+    Returns False without having written anything if copy_file_range isn't usable
+    for these files, so the caller can fall back to sendfile.
+    """
+    first_chunk = min(COPY_CHUNK_SIZE, size)
+    try:
+        copied = os.copy_file_range(in_fd, out_fd, first_chunk, 0, 0)
+        if copied == 0:
+            # Like shutil, treat filesystems that copy nothing instead of failing
+            # as not supporting copy_file_range
+            return False
+        _copy_file_range_chunk(in_fd, out_fd, copied, first_chunk - copied)
+    except OSError as e:
+        if e.errno in COPY_FILE_RANGE_UNSUPPORTED:
+            return False
+        raise
+    offsets = range(first_chunk, size, COPY_CHUNK_SIZE)
+    with ThreadPoolExecutor(min(len(offsets), COPY_MAX_CONCURRENCY)) as tpe:
+        futures = [
+            tpe.submit(
+                _copy_file_range_chunk,
+                in_fd,
+                out_fd,
+                offset,
+                min(COPY_CHUNK_SIZE, size - offset),
+            )
+            for offset in offsets
+        ]
+        for future in futures:
+            future.result()
+    return True
+
+
+def _fadvise(fd: int, offset: int, length: int, *advice: int) -> None:
+    """Gives the kernel access pattern hints for a file range, ignoring failures."""
+    for _advice in advice:
+        try:
+            os.posix_fadvise(fd, offset, length, _advice)
+        except OSError:
+            pass
+
+
+def _copy_file_in_kernel(
+    in_fd: int, out_fd: int, offset: int, count: int, parallel: bool
+) -> bool:
+    """Copies count bytes of in_fd from offset to out_fd in-kernel.
+
+    Returns False without having written anything if sendfile isn't supported for
+    these files either, so the caller can fall back to a buffered copy.
+    """
+    if (
+        parallel
+        and offset == 0
+        and os.lseek(out_fd, 0, os.SEEK_CUR) == 0
+        and count > COPY_CHUNK_SIZE
+        and hasattr(os, "copy_file_range")
+        and _copy_file_parallel(in_fd, out_fd, count)
+    ):
+        return True
+    first = True
+    while count > 0:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, count)
+        except OSError as e:
+            if first and e.errno in SENDFILE_UNSUPPORTED:
+                return False
+            raise
+        first = False
+        if sent == 0:
+            break
+        offset += sent
+        count -= sent
+    return True
+
+
+def copy_range(
+    frd: IO[bytes], output: IO[bytes], offset: int, count: int, parallel: bool = True
+) -> None:
+    """Copies up to count bytes of frd from offset to where output is at.
+
+    On Linux the copy is done in-kernel, big ones with several copy_file_range
+    calls in flight unless parallel is False, and otherwise with sendfile. The source is read ahead as it's
+    copied sequentially, and neither range is kept in the page cache afterwards.
+    Files that can't be copied in-kernel fall back to a buffered copy.
+    """
+    if IS_LINUX:
+        in_fd = frd.fileno()
+        out_fd = output.fileno()
+        out_offset = output.tell()
+        _fadvise(in_fd, offset, count, os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_WILLNEED)
+        try:
+            if _copy_file_in_kernel(in_fd, out_fd, offset, count, parallel):
+                return
+        finally:
+            _fadvise(in_fd, offset, count, os.POSIX_FADV_DONTNEED)
+            _fadvise(out_fd, out_offset, count, os.POSIX_FADV_DONTNEED)
+    frd.seek(offset)
+    while count > 0:
+        data = frd.read(min(COPY_BUFFER_SIZE, count))
+        if not data:
+            break
+        output.write(data)
+        count -= len(data)
+
 
 class SnowflakeLocalUtil(object):
     @staticmethod
@@ -26,6 +171,19 @@ class SnowflakeLocalUtil(object):
     ):
         return None
 
+    @staticmethod
+    def _copy_file(frd: IO[bytes], output: IO[bytes], is_file: bool) -> None:
+        """Copies the rest of frd into output in large blocks.
+
+        Real files are copied with copy_range, anything else (streams) falls back
+        to a buffered copy.
+        """
+        if is_file:
+            offset = frd.tell()
+            copy_range(frd, output, offset, os.fstat(frd.fileno()).st_size - offset)
+        else:
+            shutil.copyfileobj(frd, output, length=COPY_BUFFER_SIZE)
+
     @staticmethod
     def upload_one_file_with_retry(meta: "SnowflakeFileMeta") -> None:
         logger = getLogger(__name__)
@@ -38,14 +196,20 @@ class SnowflakeLocalUtil(object):
             frd = open(meta.real_src_file_name, "rb")
         else:
             frd = meta.real_src_stream or meta.src_stream
-        with open(
-            os.path.join(
-                os.path.expanduser(meta.client_meta.stage_info["location"]),
-                meta.dst_file_name,
-            ),
-            "wb",
-        ) as output:
-            output.writelines(frd)
+        try:
+            with open(
+                os.path.join(
+                    os.path.expanduser(meta.client_meta.stage_info["location"]),
+                    meta.dst_file_name,
+                ),
+                "wb",
+            ) as output:
+                SnowflakeLocalUtil._copy_file(
+                    frd, output, is_file=meta.src_stream is None
+                )
+        finally:
+            if meta.src_stream is None:
+                frd.close()
 
         meta.dst_file_size = meta.upload_size
         meta.result_status = ResultStatus.UPLOADED
@@ -67,7 +231,7 @@ class SnowflakeLocalUtil(object):
 
         with open(full_src_file_name, "rb") as frd:
             with open(full_dst_file_name, "wb+") as output:
-                output.writelines(frd)
+                SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
         statinfo = os.stat(full_dst_file_name)
         meta.dst_file_size = statinfo.st_size
         meta.result_status = ResultStatus.DOWNLOADED
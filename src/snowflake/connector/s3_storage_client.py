@@ -4,16 +4,26 @@
 
 from __future__ import division
 
-import binascii
+import hashlib
+import hmac
 import re
+import time
 import xml.etree.cElementTree as ET
-from datetime import datetime
+from functools import partial
 from io import IOBase
 from logging import getLogger
 from operator import itemgetter
-from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple, Union
-
-from cryptography.hazmat.primitives import hashes, hmac
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
 
 from .compat import quote, urlparse
 from .constants import (
@@ -21,6 +31,7 @@ from .constants import (
     HTTP_HEADER_VALUE_OCTET_STREAM,
     FileHeader,
     ResultStatus,
+    kilobyte,
 )
 from .encryption_util import EncryptionMetadata
 from .storage_client import SnowflakeStorageClient
@@ -38,13 +49,55 @@ AMZ_MATDESC = "x-amz-matdesc"
 AMZ_KEY = "x-amz-key"
 AMZ_IV = "x-amz-iv"
 
+META_SFC_DIGEST = META_PREFIX + SFC_DIGEST
+META_AMZ_MATDESC = META_PREFIX + AMZ_MATDESC
+META_AMZ_KEY = META_PREFIX + AMZ_KEY
+META_AMZ_IV = META_PREFIX + AMZ_IV
+
 ERRORNO_WSAECONNABORTED = 10053  # network connection was aborted
 
 EXPIRED_TOKEN = "ExpiredToken"
+EXPIRED_TOKEN_CODE = f"<Code>{EXPIRED_TOKEN}</Code>"
 ADDRESSING_STYLE = "virtual"  # explicit force to use virtual addressing style
 UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+# SHA-256 of b"", the payload hash of every HEAD, GET and DELETE request
+EMPTY_PAYLOAD_SHA256 = hashlib.sha256(b"").hexdigest()
 
 RE_MULTIPLE_SPACES = re.compile(r" +")
+# Values pulled out of S3 XML responses without parsing them
+RE_UPLOAD_ID = re.compile(rb"<UploadId>([^<]+)</UploadId>")
+RE_ACCELERATE_STATUS = re.compile(rb"<Status>([^<]+)</Status>")
+# Characters quote() doesn't escape on any Python version, keys made of only these
+# are returned as is. "~" is left out, quote() only stopped escaping it in 3.7
+RE_QUOTE_SAFE = re.compile(r"[A-Za-z0-9/_.-]*")
+
+# Block size used to hash streamed payloads when hashlib.file_digest is unavailable
+HASH_BLOCK_SIZE = 64 * kilobyte
+
+# Number of (secret key, date) signing keys kept per client
+SIGNING_KEY_CACHE_SIZE = 2
+
+
+def _fast_quote(path: str) -> str:
+    """Same as quote, but skips the work for the common case of nothing to escape."""
+    if RE_QUOTE_SAFE.fullmatch(path):
+        return path
+    return quote(path)
+
+
+def _find_xml_text(content: bytes, pattern: Pattern, tag: str) -> Optional[str]:
+    """Gets the text of tag, a direct child of the root of an S3 XML response.
+
+    Tries the pattern first and only parses the document if it doesn't match.
+    S3 responses are namespaced, so the tag is matched with any namespace.
+    """
+    match = pattern.search(content)
+    if match:
+        return match.group(1).decode("utf-8")
+    for child in ET.fromstring(content):
+        if child.tag == tag or child.tag.endswith("}" + tag):
+            return child.text
+    return None
 
 
 class S3Location(NamedTuple):
@@ -75,6 +128,10 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         # Multipart upload only
         self.upload_id: Optional[str] = None
         self.etags: Optional[List[str]] = None
+        # V4 signing keys by (secret key, short amzdate), replaced on write
+        self._signing_key_cache: Dict[Tuple[str, str], bytes] = {}
+        # Quoted object URLs by file name, see _get_object_url
+        self._object_urls: Dict[str, str] = {}
         self.s3location: "S3Location" = (
             SnowflakeS3RestClient._extract_bucket_name_and_path(
                 self.stage_info["location"]
@@ -104,26 +161,39 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
     @staticmethod
     def _sign_bytes(secret_key: bytes, _input: str) -> bytes:
         """Applies HMAC-SHA-256 to given string with secret_key."""
-        h = hmac.HMAC(secret_key, hashes.SHA256())
-        h.update(_input.encode("utf-8"))
-        return h.finalize()
+        return hmac.new(secret_key, _input.encode("utf-8"), hashlib.sha256).digest()
 
     @staticmethod
-    def _sign_bytes_hex(secret_key: bytes, _input: str) -> bytes:
+    def _sign_bytes_hex(secret_key: bytes, _input: str) -> str:
         """Convenience function, same as _sign_bytes, but returns result in hex form."""
-        return binascii.hexlify(SnowflakeS3RestClient._sign_bytes(secret_key, _input))
+        return hmac.new(secret_key, _input.encode("utf-8"), hashlib.sha256).hexdigest()
 
     @staticmethod
     def _hash_bytes(_input: bytes) -> bytes:
         """Applies SHA-256 hash to given bytes."""
-        digest = hashes.Hash(hashes.SHA256())
-        digest.update(_input)
-        return digest.finalize()
+        return hashlib.sha256(_input).digest()
 
     @staticmethod
-    def _hash_bytes_hex(_input: bytes) -> bytes:
+    def _hash_bytes_hex(_input: bytes) -> str:
         """Convenience function, same as _hash_bytes, but returns result in hex form."""
-        return binascii.hexlify(SnowflakeS3RestClient._hash_bytes(_input))
+        return hashlib.sha256(_input).hexdigest()
+
+    @staticmethod
+    def _hash_stream_hex(_input: IOBase) -> str:
+        """Same as _hash_bytes_hex, but hashes a stream without reading it into memory.
+
+        The stream is rewound to where it was, so it can be sent afterwards.
+        """
+        position = _input.tell()
+        # file_digest hashes a whole BytesIO regardless of its position
+        if position == 0 and hasattr(hashlib, "file_digest"):
+            digest = hashlib.file_digest(_input, "sha256")
+        else:
+            digest = hashlib.sha256()
+            for block in iter(lambda: _input.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        _input.seek(position)
+        return digest.hexdigest()
 
     @staticmethod
     def _construct_query_string(
@@ -141,26 +211,24 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
     ) -> Tuple[str, str]:
         """Construct canonical headers as per AWS specs, returns the signed headers too.
 
-        Does not support sorting by values in case the keys are the same, don't send
-        in duplicate keys, but this is not possible with a dictionary anyways.
+        Header names that only differ in case are merged, their values joined with
+        commas in the order they were given.
         """
-        res = []
-        low_key_dict = {k.lower(): v for k, v in headers.items()}
-        sorted_headers = sorted(low_key_dict.keys())
-        _res = [(k, low_key_dict[k]) for k in sorted_headers]
-
-        for k, v in _res:
+        values: Dict[str, List[str]] = {}
+        for k, v in headers.items():
+            # if multiline header, replace withs space
+            k = k.lower().replace("\n", " ").strip()
             # if value is a list, convert to string delimited by comma
             if isinstance(v, list):
                 v = ",".join(v)
-            # if multiline header, replace withs space
-            k = k.replace("\n", " ")
-            res.append(k.strip() + ":" + RE_MULTIPLE_SPACES.sub(" ", v.strip()))
-
-        ans = "\n".join(res)
-        if ans:
-            ans += "\n"
-
+            v = v.strip()
+            # collapse runs of spaces, most values have none so skip the regex
+            if "  " in v:
+                v = RE_MULTIPLE_SPACES.sub(" ", v)
+            values.setdefault(k, []).append(v)
+        sorted_headers = sorted(values)
+
+        ans = "".join(f"{k}:{','.join(values[k])}\n" for k in sorted_headers)
         return ans, ";".join(sorted_headers)
 
     @staticmethod
@@ -206,7 +274,7 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         service_name: str,
         amzdate: str,
         short_amzdate: str,
-        canonical_request_hash: bytes,
+        canonical_request_hash: str,
     ) -> Tuple[str, str]:
         """Given all the necessary information construct a V4 string to sign.
 
@@ -224,12 +292,37 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
                     "AWS4-HMAC-SHA256",
                     amzdate,
                     scope,
-                    canonical_request_hash.decode("utf-8"),
+                    canonical_request_hash,
                 ]
             ),
             scope,
         )
 
+    def _get_signing_key(self, short_amzdate: str) -> bytes:
+        """Derives the V4 signing key for the current secret key and given date.
+
+        The key only depends on the secret key, date, region and service, so it is
+        cached instead of running the 4 HMAC chain on every request.
+        """
+        secret_key = self.credentials.creds["AWS_SECRET_KEY"]
+        cache_key = (secret_key, short_amzdate)
+        signing_key = self._signing_key_cache.get(cache_key)
+        if signing_key is None:
+            kDate = self._sign_bytes(
+                ("AWS4" + secret_key).encode("utf-8"), short_amzdate
+            )
+            kRegion = self._sign_bytes(kDate, self.region_name)
+            kService = self._sign_bytes(kRegion, "s3")
+            signing_key = self._sign_bytes(kService, "aws4_request")
+            # Chunks are signed from multiple threads, so build a new dict and swap it
+            # in rather than mutating the one others might be reading
+            cache = dict(self._signing_key_cache)
+            while len(cache) >= SIGNING_KEY_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            cache[cache_key] = signing_key
+            self._signing_key_cache = cache
+        return signing_key
+
     def _has_expired_token(self, response: requests.Response) -> bool:
         """Extract error code and error message from the S3's error response.
 
@@ -247,8 +340,13 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         message = response.text
         if not message or message.isspace():
             return False
+        # Most of the time the error code can be found without parsing the XML
+        if EXPIRED_TOKEN_CODE in message:
+            return True
+        if "<Code>" not in message:
+            return False
         err = ET.fromstring(message)
-        return err.find("Code").text == EXPIRED_TOKEN
+        return err.findtext("Code") == EXPIRED_TOKEN
 
     @staticmethod
     def _extract_bucket_name_and_path(stage_location) -> "S3Location":
@@ -259,6 +357,17 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
 
         return S3Location(bucket_name=bucket_name, path=path)
 
+    def _get_object_url(self, filename: str) -> str:
+        """Returns the URL of filename in the stage location.
+
+        Every chunk of a file is sent to the same URL, so it is quoted only once.
+        """
+        url = self._object_urls.get(filename)
+        if url is None:
+            path = _fast_quote(self.s3location.path + filename.lstrip("/"))
+            url = self._object_urls[filename] = self.endpoint + f"/{path}"
+        return url
+
     def _send_request_with_authentication_and_retry(
         self,
         url: str,
@@ -267,7 +376,7 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         query_parts: Optional[Dict[str, str]] = None,
         x_amz_headers: Optional[Dict[str, str]] = None,
         headers: Optional[Dict[str, str]] = None,
-        payload: Union[bytes, bytearray, IOBase, None] = None,
+        payload: Union[bytes, bytearray, memoryview, IOBase, None] = None,
         unsigned_payload: bool = False,
     ) -> requests.Response:
         if x_amz_headers is None:
@@ -285,62 +394,84 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         x_amz_headers["host"] = parsed_url.hostname
         if unsigned_payload:
             x_amz_headers["x-amz-content-sha256"] = UNSIGNED_PAYLOAD
+        elif not payload:
+            x_amz_headers["x-amz-content-sha256"] = EMPTY_PAYLOAD_SHA256
+        elif isinstance(payload, IOBase):
+            x_amz_headers["x-amz-content-sha256"] = self._hash_stream_hex(payload)
         else:
-            x_amz_headers["x-amz-content-sha256"] = (
-                SnowflakeS3RestClient._hash_bytes_hex(payload).lower().decode()
-            )
+            x_amz_headers["x-amz-content-sha256"] = self._hash_bytes_hex(payload)
 
-        def generate_authenticated_url_and_args_v4() -> Tuple[bytes, Dict[str, bytes]]:
-            t = datetime.utcnow()
-            amzdate = t.strftime("%Y%m%dT%H%M%SZ")
-            short_amzdate = amzdate[:8]
-            x_amz_headers["x-amz-date"] = amzdate
-
-            (
-                canonical_request,
-                signed_headers,
-            ) = self._construct_canonical_request_and_signed_headers(
-                verb=verb,
-                canonical_uri_parameter=parsed_url.path
-                + (f";{parsed_url.params}" if parsed_url.params else ""),
-                query_parts=query_parts,
-                canonical_headers=x_amz_headers,
-                payload_hash=x_amz_headers["x-amz-content-sha256"],
-            )
-            string_to_sign, scope = self._construct_string_to_sign(
-                self.region_name,
-                "s3",
-                amzdate,
-                short_amzdate,
-                self._hash_bytes_hex(canonical_request.encode("utf-8")).lower(),
-            )
-            kDate = self._sign_bytes(
-                ("AWS4" + self.credentials.creds["AWS_SECRET_KEY"]).encode("utf-8"),
-                short_amzdate,
-            )
-            kRegion = self._sign_bytes(kDate, self.region_name)
-            kService = self._sign_bytes(kRegion, "s3")
-            signing_key = self._sign_bytes(kService, "aws4_request")
+        canonical_uri = parsed_url.path + (
+            f";{parsed_url.params}" if parsed_url.params else ""
+        )
+        return self._send_request_with_retry(
+            verb,
+            partial(
+                self._generate_authenticated_url_and_args_v4,
+                url,
+                verb,
+                canonical_uri,
+                query_parts,
+                x_amz_headers,
+                headers,
+                payload,
+            ),
+            retry_id,
+        )
 
-            signature = self._sign_bytes_hex(signing_key, string_to_sign).lower()
-            authorization_header = (
-                "AWS4-HMAC-SHA256 "
-                + f"Credential={self.credentials.creds['AWS_KEY_ID']}/{scope}, "
-                + f"SignedHeaders={signed_headers}, "
-                + f"Signature={signature.decode('utf-8')}"
-            )
-            headers.update(x_amz_headers)
-            headers["Authorization"] = authorization_header
-            rest_args = {"headers": headers}
+    def _generate_authenticated_url_and_args_v4(
+        self,
+        url: str,
+        verb: str,
+        canonical_uri: str,
+        query_parts: Dict[str, str],
+        x_amz_headers: Dict[str, str],
+        headers: Dict[str, str],
+        payload: Union[bytes, bytearray, memoryview, IOBase],
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """Signs a request with the current time, called again for every retry."""
+        t = time.gmtime()
+        amzdate = (
+            f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}"
+            f"T{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}Z"
+        )
+        short_amzdate = amzdate[:8]
+        x_amz_headers["x-amz-date"] = amzdate
 
-            if payload:
-                rest_args["data"] = payload
+        (
+            canonical_request,
+            signed_headers,
+        ) = self._construct_canonical_request_and_signed_headers(
+            verb=verb,
+            canonical_uri_parameter=canonical_uri,
+            query_parts=query_parts,
+            canonical_headers=x_amz_headers,
+            payload_hash=x_amz_headers["x-amz-content-sha256"],
+        )
+        string_to_sign, scope = self._construct_string_to_sign(
+            self.region_name,
+            "s3",
+            amzdate,
+            short_amzdate,
+            self._hash_bytes_hex(canonical_request.encode("utf-8")),
+        )
+        signing_key = self._get_signing_key(short_amzdate)
+
+        signature = self._sign_bytes_hex(signing_key, string_to_sign)
+        authorization_header = (
+            "AWS4-HMAC-SHA256 "
+            + f"Credential={self.credentials.creds['AWS_KEY_ID']}/{scope}, "
+            + f"SignedHeaders={signed_headers}, "
+            + f"Signature={signature}"
+        )
+        headers.update(x_amz_headers)
+        headers["Authorization"] = authorization_header
+        rest_args = {"headers": headers}
 
-            return url.encode("utf-8"), rest_args
+        if payload:
+            rest_args["data"] = payload
 
-        return self._send_request_with_retry(
-            verb, generate_authenticated_url_and_args_v4, retry_id
-        )
+        return url.encode("utf-8"), rest_args
 
     def get_file_header(self, filename: str) -> Optional[FileHeader]:
         """Gets the metadata of file in specified location.
@@ -352,7 +483,7 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
             None if HEAD returns 404, otherwise a FileHeader instance populated
             with metadata
         """
-        path = quote(self.s3location.path + filename.lstrip("/"))
+        path = _fast_quote(self.s3location.path + filename.lstrip("/"))
         url = self.endpoint + f"/{path}"
 
         retry_id = "HEAD"
@@ -365,15 +496,15 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
             metadata = response.headers
             encryption_metadata = (
                 EncryptionMetadata(
-                    key=metadata.get(META_PREFIX + AMZ_KEY),
-                    iv=metadata.get(META_PREFIX + AMZ_IV),
-                    matdesc=metadata.get(META_PREFIX + AMZ_MATDESC),
+                    key=metadata.get(META_AMZ_KEY),
+                    iv=metadata.get(META_AMZ_IV),
+                    matdesc=metadata.get(META_AMZ_MATDESC),
                 )
-                if metadata.get(META_PREFIX + AMZ_KEY)
+                if metadata.get(META_AMZ_KEY)
                 else None
             )
             return FileHeader(
-                digest=metadata.get(META_PREFIX + SFC_DIGEST),
+                digest=metadata.get(META_SFC_DIGEST),
                 content_length=int(metadata.get("Content-Length")),
                 encryption_metadata=encryption_metadata,
             )
@@ -393,23 +524,22 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
 
         """
         s3_metadata = {
-            META_PREFIX + SFC_DIGEST: self.meta.sha256_digest,
+            META_SFC_DIGEST: self.meta.sha256_digest,
         }
         if self.encryption_metadata:
             s3_metadata.update(
                 {
-                    META_PREFIX + AMZ_IV: self.encryption_metadata.iv,
-                    META_PREFIX + AMZ_KEY: self.encryption_metadata.key,
-                    META_PREFIX + AMZ_MATDESC: self.encryption_metadata.matdesc,
+                    META_AMZ_IV: self.encryption_metadata.iv,
+                    META_AMZ_KEY: self.encryption_metadata.key,
+                    META_AMZ_MATDESC: self.encryption_metadata.matdesc,
                 }
             )
         return s3_metadata
 
     def _initiate_multipart_upload(self) -> None:
         query_parts = (("uploads", ""),)
-        path = quote(self.s3location.path + self.meta.dst_file_name.lstrip("/"))
         query_string = self._construct_query_string(query_parts)
-        url = self.endpoint + f"/{path}?{query_string}"
+        url = self._get_object_url(self.meta.dst_file_name) + f"?{query_string}"
         s3_metadata = self._prepare_file_metadata()
         # initiate multipart upload
         retry_id = "Initiate"
@@ -423,14 +553,13 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
             query_parts=dict(query_parts),
         )
         if response.status_code == 200:
-            self.upload_id = ET.fromstring(response.content)[2].text
+            self.upload_id = _find_xml_text(response.content, RE_UPLOAD_ID, "UploadId")
             self.etags = [None] * self.num_of_chunks
         else:
             response.raise_for_status()
 
-    def _upload_chunk(self, chunk_id: int, chunk: bytes) -> None:
-        path = quote(self.s3location.path + self.meta.dst_file_name.lstrip("/"))
-        url = self.endpoint + f"/{path}"
+    def _upload_chunk(self, chunk_id: int, chunk: Union[bytes, memoryview]) -> None:
+        url = self._get_object_url(self.meta.dst_file_name)
 
         if self.num_of_chunks == 1:  # single request
             s3_metadata = self._prepare_file_metadata()
@@ -466,28 +595,23 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
 
     def _complete_multipart_upload(self) -> None:
         query_parts = (("uploadId", self.upload_id),)
-        path = quote(self.s3location.path + self.meta.dst_file_name.lstrip("/"))
         query_string = self._construct_query_string(query_parts)
-        url = self.endpoint + f"/{path}?{query_string}"
+        url = self._get_object_url(self.meta.dst_file_name) + f"?{query_string}"
         logger.debug("Initiating multipart upload complete")
-        # Complete multipart upload
-        root = ET.Element("CompleteMultipartUpload")
-        for idx, etag_str in enumerate(self.etags):
-            part = ET.Element("Part")
-            etag = ET.Element("ETag")
-            etag.text = etag_str
-            part.append(etag)
-            part_number = ET.Element("PartNumber")
-            part_number.text = str(idx + 1)
-            part.append(part_number)
-            root.append(part)
+        # Complete multipart upload, ETags are quoted hex strings so need no escaping
+        assert not any("<" in etag or "&" in etag for etag in self.etags)
+        parts = "".join(
+            f"<Part><ETag>{etag}</ETag><PartNumber>{idx + 1}</PartNumber></Part>"
+            for idx, etag in enumerate(self.etags)
+        )
+        payload = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>"
         retry_id = "Complete"
         self.retry_count[retry_id] = 0
         response = self._send_request_with_authentication_and_retry(
             url=url,
             verb="POST",
             retry_id=retry_id,
-            payload=ET.tostring(root),
+            payload=payload.encode("utf-8"),
             query_parts=dict(query_parts),
         )
         response.raise_for_status()
@@ -496,9 +620,8 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
         if self.upload_id is None:
             return
         query_parts = (("uploadId", self.upload_id),)
-        path = quote(self.s3location.path + self.meta.dst_file_name.lstrip("/"))
         query_string = self._construct_query_string(query_parts)
-        url = self.endpoint + f"/{path}?{query_string}"
+        url = self._get_object_url(self.meta.dst_file_name) + f"?{query_string}"
 
         retry_id = "Abort"
         self.retry_count[retry_id] = 0
@@ -512,8 +635,7 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
 
     def download_chunk(self, chunk_id: int) -> None:
         logger.debug(f"Downloading chunk {chunk_id}")
-        path = quote(self.s3location.path + self.meta.src_file_name.lstrip("/"))
-        url = self.endpoint + f"/{path}"
+        url = self._get_object_url(self.meta.src_file_name)
         if self.num_of_chunks == 1:
             response = self._send_request_with_authentication_and_retry(
                 url=url, verb="GET", retry_id=chunk_id
@@ -549,9 +671,9 @@ class SnowflakeS3RestClient(SnowflakeStorageClient):
             url=url, verb="GET", retry_id=retry_id, query_parts=dict(query_parts)
         )
         if response.status_code == 200:
-            config = ET.fromstring(response.text)
             use_accelerate_endpoint = (
-                config.find("Status") and config.find("Status").text == "Enabled"
+                _find_xml_text(response.content, RE_ACCELERATE_STATUS, "Status")
+                == "Enabled"
             )
             logger.debug(f"use_accelerate_endpoint: {use_accelerate_endpoint}")
             return use_accelerate_endpoint
@@ -5,6 +5,7 @@
 from __future__ import division
 
 import os
+import queue
 import shutil
 import tempfile
 import threading
@@ -47,6 +48,31 @@ class SnowflakeFileEncryptionMaterial(NamedTuple):
     smk_id: int  # SMK id
 
 
+# Chunk buffers are reused across multipart chunks instead of allocating a new
+# chunk_size bytes object for every part, at most MAX_POOLED_BUFFERS are kept
+MAX_POOLED_BUFFERS = 8
+_BUFFER_POOL: "queue.LifoQueue[bytearray]" = queue.LifoQueue(MAX_POOLED_BUFFERS)
+
+
+def _acquire_buffer(size: int) -> bytearray:
+    """Returns a pooled buffer of at least size bytes, or a new one."""
+    try:
+        buf = _BUFFER_POOL.get_nowait()
+    except queue.Empty:
+        return bytearray(size)
+    if len(buf) < size:
+        return bytearray(size)
+    return buf
+
+
+def _release_buffer(buf: bytearray) -> None:
+    """Returns a buffer to the pool, it's dropped if the pool is full."""
+    try:
+        _BUFFER_POOL.put_nowait(buf)
+    except queue.Full:
+        pass
+
+
 METHODS = {
     "GET": requests.get,
     "PUT": requests.put,
@@ -389,18 +415,36 @@ class SnowflakeStorageClient(ABC):
             or self.meta.src_stream
             or open(self.data_file, "rb")
         )
-        with fd:
-            if self.num_of_chunks == 1:
-                _data = fd.read()
-            else:
-                fd.seek(chunk_id * self.chunk_size)
-                _data = fd.read(self.chunk_size)
-        logger.debug(f"Uploading chunk {chunk_id} of file {self.data_file}")
-        self._upload_chunk(chunk_id, _data)
-        logger.debug(f"Successfully uploaded chunk {chunk_id} of file {self.data_file}")
+        buf = _data = None
+        try:
+            with fd:
+                if self.num_of_chunks > 1:
+                    fd.seek(chunk_id * self.chunk_size)
+                    buf = _acquire_buffer(self.chunk_size)
+                    with memoryview(buf)[: self.chunk_size] as view:
+                        _data = view[: fd.readinto(view)]
+                else:
+                    _data = fd.read()
+            logger.debug(f"Uploading chunk {chunk_id} of file {self.data_file}")
+            self._upload_chunk(chunk_id, _data)
+            logger.debug(
+                f"Successfully uploaded chunk {chunk_id} of file {self.data_file}"
+            )
+        finally:
+            if buf is not None:
+                if _data is not None:
+                    # Responses and errors may still hold the chunk as their request
+                    # body, release it so they can't read the next chunk's data
+                    _data.release()
+                _release_buffer(buf)
 
     @abstractmethod
-    def _upload_chunk(self, chunk_id: int, chunk: bytes) -> None:
+    def _upload_chunk(self, chunk_id: int, chunk: Union[bytes, memoryview]) -> None:
+        """Uploads a chunk, for multipart uploads chunk is a view of a pooled buffer.
+
+        The buffer is reused once this returns and chunk is released, so neither it
+        nor the body of a returned or raised response's request can be used after.
+        """
         pass
 
     @abstractmethod
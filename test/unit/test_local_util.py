@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2012-2021 Snowflake Computing Inc. All right reserved.
+#
+
+import errno
+import os
+from io import BytesIO
+
+import mock
+import pytest
+
+from snowflake.connector.compat import IS_LINUX
+from snowflake.connector.local_util_sdk import (
+    COPY_BUFFER_SIZE,
+    COPY_CHUNK_SIZE,
+    SnowflakeLocalUtil,
+)
+
+
+@pytest.mark.parametrize(
+    "size", [0, 10, COPY_CHUNK_SIZE, 3 * COPY_CHUNK_SIZE + 7], ids=str
+)
+@pytest.mark.parametrize("is_file", [True, False])
+def test_copy_file(tmp_path, size, is_file):
+    """Tests copying files and streams to the local stage."""
+    content = os.urandom(size)
+    src_file = tmp_path / "src"
+    src_file.write_bytes(content)
+    dst_file = tmp_path / "dst"
+    with open(src_file, "rb") if is_file else BytesIO(content) as frd:
+        with open(dst_file, "wb") as output:
+            SnowflakeLocalUtil._copy_file(frd, output, is_file=is_file)
+    assert dst_file.read_bytes() == content
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+@pytest.mark.parametrize(
+    "copy_file_range",
+    [
+        {"side_effect": OSError(errno.EXDEV, "Invalid cross-device link")},
+        {"return_value": 0},
+    ],
+    ids=["EXDEV", "nothing copied"],
+)
+def test_copy_file_falls_back_to_sendfile(tmp_path, copy_file_range):
+    """Tests that files are still copied when copy_file_range isn't supported."""
+    content = os.urandom(2 * COPY_CHUNK_SIZE)
+    src_file = tmp_path / "src"
+    src_file.write_bytes(content)
+    dst_file = tmp_path / "dst"
+    with mock.patch("os.copy_file_range", **copy_file_range):
+        with open(src_file, "rb") as frd, open(dst_file, "wb") as output:
+            SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+    assert dst_file.read_bytes() == content
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+def test_copy_file_range_copies_nothing(tmp_path):
+    """Tests that copy_file_range stopping short after the first call is an error."""
+    src_file = tmp_path / "src"
+    src_file.write_bytes(os.urandom(2 * COPY_CHUNK_SIZE))
+    real_copy_file_range = os.copy_file_range
+
+    def copy_file_range(in_fd, out_fd, count, offset_src, offset_dst):
+        if offset_src:
+            return 0
+        return real_copy_file_range(in_fd, out_fd, count, offset_src, offset_dst)
+
+    with mock.patch("os.copy_file_range", side_effect=copy_file_range):
+        with open(src_file, "rb") as frd, open(tmp_path / "dst", "wb") as output:
+            with pytest.raises(OSError, match="copy_file_range copied nothing"):
+                SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+@pytest.mark.parametrize("err", [errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK])
+def test_copy_file_falls_back_to_buffered_copy(tmp_path, err):
+    """Tests that files are still copied when sendfile isn't supported."""
+    content = os.urandom(COPY_BUFFER_SIZE + 7)
+    src_file = tmp_path / "src"
+    src_file.write_bytes(content)
+    dst_file = tmp_path / "dst"
+    with mock.patch("os.sendfile", side_effect=OSError(err, os.strerror(err))):
+        with open(src_file, "rb") as frd, open(dst_file, "wb") as output:
+            SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+    assert dst_file.read_bytes() == content
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+def test_copy_file_sendfile_error(tmp_path):
+    """Tests that sendfile errors after the first call aren't hidden by a fallback."""
+    src_file = tmp_path / "src"
+    src_file.write_bytes(os.urandom(100))
+    with mock.patch(
+        "os.sendfile", side_effect=[10, OSError(errno.EINVAL, "Invalid argument")]
+    ):
+        with open(src_file, "rb") as frd, open(tmp_path / "dst", "wb") as output:
+            with pytest.raises(OSError):
+                SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+def test_copy_file_parallel_chunks(tmp_path):
+    """Tests that big files are copied in COPY_CHUNK_SIZE pieces with copy_file_range."""
+    size = 3 * COPY_CHUNK_SIZE + 7
+    content = os.urandom(size)
+    src_file = tmp_path / "src"
+    src_file.write_bytes(content)
+    dst_file = tmp_path / "dst"
+    with mock.patch("os.copy_file_range", wraps=os.copy_file_range) as cfr:
+        with open(src_file, "rb") as frd, open(dst_file, "wb") as output:
+            SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+    assert dst_file.read_bytes() == content
+    offsets = {call.args[3] for call in cfr.call_args_list}
+    assert {0, COPY_CHUNK_SIZE, 2 * COPY_CHUNK_SIZE, 3 * COPY_CHUNK_SIZE} <= offsets
+
+
+@pytest.mark.skipif(not IS_LINUX, reason="in-kernel copies are Linux only")
+def test_copy_file_fadvise(tmp_path):
+    """Tests that the copied ranges are read ahead and dropped from the page cache."""
+    src_file = tmp_path / "src"
+    src_file.write_bytes(os.urandom(100))
+    with mock.patch("os.posix_fadvise") as fadvise:
+        with open(src_file, "rb") as frd, open(tmp_path / "dst", "wb") as output:
+            SnowflakeLocalUtil._copy_file(frd, output, is_file=True)
+            in_fd, out_fd = frd.fileno(), output.fileno()
+    assert fadvise.call_args_list == [
+        mock.call(in_fd, 0, 100, os.POSIX_FADV_SEQUENTIAL),
+        mock.call(in_fd, 0, 100, os.POSIX_FADV_WILLNEED),
+        mock.call(in_fd, 0, 100, os.POSIX_FADV_DONTNEED),
+        mock.call(out_fd, 0, 100, os.POSIX_FADV_DONTNEED),
+    ]
@@ -1,3 +1,123 @@
 #
 # Copyright (c) 2012-2021 Snowflake Computing Inc. All right reserved.
 #
+
+import os
+
+import mock
+import pytest
+
+from snowflake.connector.file_transfer_agent import SnowflakeFileMeta
+from snowflake.connector.local_storage_client import SnowflakeLocalStorageClient
+from snowflake.connector.local_util_sdk import COPY_CHUNK_SIZE
+from snowflake.connector.storage_client import SnowflakeStorageClient
+
+
+def test_upload_chunk_reuses_buffers(tmp_path):
+    """Tests that multipart chunks are read into pooled buffers and sent as views."""
+    src_file = tmp_path / "data.txt"
+    content = b"".join(bytes([i]) * 10 for i in range(5)) + b"tail"
+    src_file.write_bytes(content)
+    meta = SnowflakeFileMeta(
+        name="data.txt",
+        src_file_name=str(src_file),
+        stage_location_type="LOCAL_FS",
+        dst_file_name="data.txt",
+    )
+    client = SnowflakeLocalStorageClient(
+        meta, {"location": str(tmp_path / "stage")}, chunk_size=10
+    )
+    client.data_file = str(src_file)
+    client.num_of_chunks = 6
+    chunks = {}
+    buffers = set()
+    views = []
+
+    def record_chunk(chunk_id, chunk):
+        assert isinstance(chunk, memoryview)
+        buffers.add(id(chunk.obj))
+        chunks[chunk_id] = bytes(chunk)
+        views.append(chunk)
+
+    with mock.patch.object(client, "_upload_chunk", side_effect=record_chunk):
+        for chunk_id in range(client.num_of_chunks):
+            # the local client copies files directly, go through the buffered path
+            SnowflakeStorageClient.upload_chunk(client, chunk_id)
+    assert b"".join(chunks[i] for i in range(client.num_of_chunks)) == content
+    assert len(buffers) == 1
+    # views of a reused buffer are released instead of showing later chunks
+    with pytest.raises(ValueError):
+        bytes(views[0])
+
+
+def test_local_client_copies_files(tmp_path):
+    """Tests that the local client copies multi-chunk files to and from the stage."""
+    content = os.urandom(10 * 1024 + 7)
+    src_file = tmp_path / "data.txt"
+    src_file.write_bytes(content)
+    stage_dir = tmp_path / "stage"
+    stage_dir.mkdir()
+    # a stale, longer stage file must not leave anything behind
+    (stage_dir / "data.txt").write_bytes(os.urandom(20 * 1024))
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    meta = SnowflakeFileMeta(
+        name="data.txt",
+        src_file_name=str(src_file),
+        src_file_size=len(content),
+        stage_location_type="LOCAL_FS",
+        dst_file_name="data.txt",
+        overwrite=True,
+        multipart_threshold=1024,
+    )
+    client = SnowflakeLocalStorageClient(
+        meta, {"location": str(stage_dir)}, chunk_size=1024
+    )
+    client.prepare_upload()
+    assert client.num_of_chunks == 11
+    for chunk_id in reversed(range(client.num_of_chunks)):
+        client.upload_chunk(chunk_id)
+    assert (stage_dir / "data.txt").read_bytes() == content
+
+    meta = SnowflakeFileMeta(
+        name="data.txt",
+        src_file_name="data.txt",
+        stage_location_type="LOCAL_FS",
+        dst_file_name="data.txt",
+        local_location=str(local_dir),
+        multipart_threshold=1024,
+    )
+    client = SnowflakeLocalStorageClient(
+        meta, {"location": str(stage_dir)}, chunk_size=1024
+    )
+    client.prepare_download()
+    for chunk_id in range(client.num_of_chunks):
+        client.download_chunk(chunk_id)
+    assert (local_dir / "data.txt").read_bytes() == content
+    assert os.listdir(local_dir) == ["data.txt"]
+
+
+def test_local_client_copies_without_nested_pool(tmp_path):
+    """Tests that the local client doesn't start a copy thread pool per chunk."""
+    src_file = tmp_path / "data.txt"
+    src_file.write_bytes(os.urandom(COPY_CHUNK_SIZE + 7))
+    stage_dir = tmp_path / "stage"
+    stage_dir.mkdir()
+    meta = SnowflakeFileMeta(
+        name="data.txt",
+        src_file_name=str(src_file),
+        src_file_size=COPY_CHUNK_SIZE + 7,
+        stage_location_type="LOCAL_FS",
+        dst_file_name="data.txt",
+    )
+    client = SnowflakeLocalStorageClient(
+        meta, {"location": str(stage_dir)}, chunk_size=1024
+    )
+    client.prepare_upload()
+    assert client.num_of_chunks == 1
+    with mock.patch(
+        "snowflake.connector.local_util_sdk.ThreadPoolExecutor"
+    ) as thread_pool:
+        client.upload_chunk(0)
+    thread_pool.assert_not_called()
+    assert (stage_dir / "data.txt").read_bytes() == src_file.read_bytes()